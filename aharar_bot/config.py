@@ -9,6 +9,13 @@ ADMIN_CHAT_ID: Final[int] = int(os.getenv("ADMIN_CHAT_ID", "0"))
 ADMIN_USERNAME: Final[str] = "@Ahrarcharity_admin"
 
 
+# Webhook Configuration (leave PUBLIC_HOST empty to fall back to long polling)
+PUBLIC_HOST: Final[str] = os.getenv("PUBLIC_HOST", "")
+WEBHOOK_LISTEN: Final[str] = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT: Final[int] = int(os.getenv("PORT", "8443"))
+WEBHOOK_SECRET: Final[str] = os.getenv("WEBHOOK_SECRET", "")
+
+
 # Database Configuration
 DATABASE_PATH: Final[str] = os.getenv("DATABASE_PATH", "aharar_bot.db")
 SEED_DATA_PATH: Final[str] = os.getenv("SEED_DATA_PATH", "./data/seed_data.csv")
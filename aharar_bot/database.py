@@ -1,44 +1,121 @@
 """Database module for Aharar Charity Bot."""
 
 import sqlite3
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 import csv
+import logging
+import time
+
+import aiosqlite
 
 from .config import DATABASE_PATH, SEED_DATA_PATH, PaymentStatus, UserStatus
+from .utils import normalize_pin, pin_to_numeric
+
+logger = logging.getLogger(__name__)
+
+# Every contactable user with their payment status for a given month
+MONTHLY_SUMMARY_QUERY = """
+    SELECT
+        u.full_name,
+        u.donation_amount,
+        COALESCE(p.status, ?) as payment_status
+    FROM users u
+    LEFT JOIN payments p ON u.id = p.user_id
+        AND p.jalali_month = ? AND p.jalali_year = ?
+    WHERE u.telegram_id IS NOT NULL
+    ORDER BY u.full_name
+"""
+
+# Seconds a get_user_by_telegram_id result is served from memory
+USER_CACHE_TTL = 60.0
+
+# Users whose payment history is kept in memory (least recently used evicted)
+HISTORY_CACHE_SIZE = 1024
+
+
+def _iter_seed_rows(
+    reader: csv.DictReader,
+) -> Iterator[tuple[str, Optional[int], str, str, str, str]]:
+    """Yield user insert parameters from seed CSV rows, skipping incomplete ones."""
+    for row in reader:
+        # normalize keys by stripping whitespace and removing BOM if present
+        normalized = { (k.strip().lstrip("\ufeff") if k else ""): (v or "").strip() for k, v in row.items() }
+
+        # Normalize pin before inserting (handles Persian digits, whitespace)
+        pin_code = normalize_pin(normalized.get("pin-code", ""))
+        full_name = normalized.get("full name", "")
+        amount = normalized.get("amount", "")
+        donation_link = normalized.get("donation link", "")
+
+        if pin_code and full_name:
+            yield (
+                pin_code,
+                pin_to_numeric(pin_code),
+                full_name,
+                amount or "0",
+                donation_link or "",
+                UserStatus.UNVERIFIED,
+            )
 
 
 class Database:
-    """Database management class."""
+    """Database management class.
+
+    Queries run on aiosqlite's worker thread so disk I/O never blocks the
+    event loop. Call ``await init_db()`` before first use.
+    """
 
     def __init__(self, db_path: str = DATABASE_PATH) -> None:
-        """Initialize database connection."""
+        """Initialize database settings (the connection is opened by init_db)."""
         self.db_path = db_path
-        self.conn: Optional[sqlite3.Connection] = None
-        self.init_db()
+        self.conn: Optional[aiosqlite.Connection] = None
+        # telegram_id -> (expires_at, user row) for active sessions
+        self._user_cache: dict[int, tuple[float, dict]] = {}
+        # user_id -> payment history rows, invalidated on payment writes
+        self._history_cache: OrderedDict[int, list[sqlite3.Row]] = OrderedDict()
 
-    def connect(self) -> None:
-        """Connect to database."""
-        self.conn = sqlite3.connect(self.db_path)
+    async def connect(self) -> None:
+        """Connect to database.
+
+        Runs in autocommit mode; multi-statement writes use explicit BEGIN/COMMIT.
+        Queries go through ``conn.execute`` so sqlite3's statement cache is reused.
+        """
+        self.conn = await aiosqlite.connect(
+            self.db_path,
+            isolation_level=None,
+            cached_statements=256,
+        )
         self.conn.row_factory = sqlite3.Row
+        await self.conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA temp_store = MEMORY;
+            PRAGMA cache_size = -20000;
+            PRAGMA mmap_size = 268435456;
+            PRAGMA foreign_keys = ON;
+            """
+        )
 
-    def close(self) -> None:
+    async def close(self) -> None:
         """Close database connection."""
         if self.conn:
-            self.conn.close()
+            await self.conn.close()
 
-    def init_db(self) -> None:
+    async def init_db(self) -> None:
         """Initialize database tables."""
-        self.connect()
-        cursor = self.conn.cursor()
+        await self.connect()
 
         # Create users table
-        cursor.execute(
+        await self.conn.execute(
             f"""
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 pin_code TEXT UNIQUE NOT NULL,
+                pin_numeric INTEGER,
                 full_name TEXT NOT NULL,
                 telegram_id INTEGER UNIQUE,
                 donation_amount TEXT NOT NULL,
@@ -51,7 +128,7 @@ class Database:
         )
 
         # Create payments table
-        cursor.execute(
+        await self.conn.execute(
             f"""
             CREATE TABLE IF NOT EXISTS payments (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -68,7 +145,7 @@ class Database:
         )
 
         # Create pending approvals table
-        cursor.execute(
+        await self.conn.execute(
             """
             CREATE TABLE IF NOT EXISTS pending_approvals (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -80,21 +157,45 @@ class Database:
             """
         )
 
-        self.conn.commit()
-        self.seed_users()
+        # Add pin_numeric to databases created before the column existed
+        columns = {
+            row["name"]
+            for row in await self.conn.execute_fetchall("PRAGMA table_info(users)")
+        }
+        if "pin_numeric" not in columns:
+            await self.conn.execute("ALTER TABLE users ADD COLUMN pin_numeric INTEGER")
+            await self.conn.execute(
+                """
+                UPDATE users SET pin_numeric = CAST(pin_code AS INTEGER)
+                WHERE pin_code != '' AND pin_code NOT GLOB '*[^0-9]*'
+                AND length(pin_code) <= 18
+                """
+            )
+
+        # Indexes for hot lookups (telegram_id is already covered by its UNIQUE index)
+        await self.conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS idx_users_pin_numeric ON users (pin_numeric);
+            CREATE INDEX IF NOT EXISTS idx_users_status ON users (status);
+            CREATE INDEX IF NOT EXISTS idx_payments_user_month
+                ON payments (user_id, jalali_year, jalali_month);
+            CREATE INDEX IF NOT EXISTS idx_payments_month_status
+                ON payments (jalali_year, jalali_month, status);
+            """
+        )
+
+        await self.seed_users()
 
-    def seed_users(self) -> None:
+    async def seed_users(self) -> None:
         """Seed users from CSV file.
 
         This normalizes CSV header names (stripping whitespace) so imperfect CSV
         headers like "pin-code " still work.
         """
-        cursor = self.conn.cursor()
-
         # Check if users already exist
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] > 0:
-            return
+        async with self.conn.execute("SELECT COUNT(*) FROM users") as cursor:
+            if (await cursor.fetchone())[0] > 0:
+                return
 
         # Read CSV file
         csv_path = Path(SEED_DATA_PATH)
@@ -102,155 +203,252 @@ class Database:
             logger.info("Seed CSV not found at %s, skipping seeding.", csv_path)
             return
 
+        # Stream rows straight into a single executemany inside one transaction
         with open(csv_path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
-            for row in reader:
-                # normalize keys by stripping whitespace and removing BOM if present
-                normalized = { (k.strip().lstrip("\ufeff") if k else ""): (v or "").strip() for k, v in row.items() }
-
-                pin_code = normalized.get("pin-code", "")
-                full_name = normalized.get("full name", "")
-                amount = normalized.get("amount", "")
-                donation_link = normalized.get("donation link", "")
-
-                # Normalize pin before inserting (handles Persian digits, whitespace)
-                from .utils import normalize_pin
-
-                pin_code = normalize_pin(pin_code)
-
-                if pin_code and full_name:
-                    cursor.execute(
-                        """
-                        INSERT INTO users (pin_code, full_name, donation_amount, 
-                                         donation_link, status)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (
-                            pin_code,
-                            full_name,
-                            amount or "0",
-                            donation_link or "",
-                            UserStatus.UNVERIFIED,
-                        ),
-                    )
-
-        self.conn.commit()
-
-    def get_user_by_pin(self, pin_code: str) -> Optional[dict]:
+            await self.conn.execute("BEGIN")
+            try:
+                await self.conn.executemany(
+                    """
+                    INSERT INTO users (pin_code, pin_numeric, full_name,
+                                     donation_amount, donation_link, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    _iter_seed_rows(reader),
+                )
+            except Exception:
+                await self.conn.execute("ROLLBACK")
+                raise
+            await self.conn.execute("COMMIT")
+
+    async def get_user_by_pin(self, pin_code: str) -> Optional[dict]:
         """Get user by pin code (normalized).
 
         Attempts exact normalized match first, then numeric match ignoring leading
         zeros as a fallback for user convenience.
         """
-        from .utils import normalize_pin
-
         normalized_pin = normalize_pin(pin_code)
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE pin_code = ?", (normalized_pin,))
-        row = cursor.fetchone()
+        async with self.conn.execute(
+            "SELECT * FROM users WHERE pin_code = ?", (normalized_pin,)
+        ) as cursor:
+            row = await cursor.fetchone()
         if row:
             return dict(row)
 
         # Fallback: if normalized pin is numeric, try numeric equality ignoring leading zeros
-        if normalized_pin.isdigit():
-            cursor.execute("SELECT * FROM users")
-            for r in cursor.fetchall():
-                db_pin = (r["pin_code"] or "").strip()
-                if db_pin.isdigit():
-                    try:
-                        if int(db_pin) == int(normalized_pin):
-                            return dict(r)
-                    except ValueError:
-                        continue
+        pin_numeric = pin_to_numeric(normalized_pin)
+        if pin_numeric is not None:
+            async with self.conn.execute(
+                "SELECT * FROM users WHERE pin_numeric = ?", (pin_numeric,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                return dict(row)
 
         return None
 
-    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
-        """Get user by Telegram ID."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+    async def get_user_by_telegram_id(self, telegram_id: int) -> Optional[dict]:
+        """Get user by Telegram ID (cached for USER_CACHE_TTL seconds)."""
+        cached = self._user_cache.get(telegram_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        async with self.conn.execute(
+            "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            self._user_cache.pop(telegram_id, None)
+            return None
+
+        user = dict(row)
+        self._user_cache[telegram_id] = (time.monotonic() + USER_CACHE_TTL, user)
+        return user
+
+    async def get_user_id_by_telegram_id(self, telegram_id: int) -> Optional[int]:
+        """Get only the user ID for a Telegram ID."""
+        cached = self._user_cache.get(telegram_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]["id"]
+
+        async with self.conn.execute(
+            "SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    def _invalidate_cached_user(self, user_id: int) -> None:
+        """Drop cached lookups for a user after their row changes."""
+        stale = [tid for tid, (_, user) in self._user_cache.items() if user["id"] == user_id]
+        for tid in stale:
+            del self._user_cache[tid]
+
+    async def update_user_telegram_id(
+        self, user_id: int, telegram_id: int, status: Optional[str] = None
+    ) -> None:
+        """Update user's Telegram ID, optionally setting status in the same UPDATE.
 
-    def update_user_telegram_id(self, user_id: int, telegram_id: int) -> None:
-        """Update user's Telegram ID without changing status."""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            UPDATE users SET telegram_id = ?, updated_at = ?
-            WHERE id = ?
-            """,
-            (telegram_id, datetime.now(), user_id),
-        )
-        self.conn.commit()
+        Status is left unchanged unless one is given.
+        """
+        if status:
+            await self.conn.execute(
+                """
+                UPDATE users SET telegram_id = ?, status = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (telegram_id, status, datetime.now(), user_id),
+            )
+        else:
+            await self.conn.execute(
+                """
+                UPDATE users SET telegram_id = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (telegram_id, datetime.now(), user_id),
+            )
+        self._invalidate_cached_user(user_id)
+        self._user_cache.pop(telegram_id, None)
 
-    def logout_user_by_telegram_id(self, telegram_id: int) -> None:
+    async def logout_user_by_telegram_id(self, telegram_id: int) -> None:
         """Logout user: clear telegram_id only (don't modify status)."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        await self.conn.execute(
             """
             UPDATE users SET telegram_id = NULL, updated_at = ?
             WHERE telegram_id = ?
             """,
             (datetime.now(), telegram_id),
         )
-        self.conn.commit()
+        self._user_cache.pop(telegram_id, None)
 
-    def get_user_by_id(self, user_id: int) -> Optional[dict]:
-        """Get user by ID."""
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+    async def get_users_by_ids(self, user_ids) -> dict[int, sqlite3.Row]:
+        """Get several users with a single query, keyed by user ID."""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
 
-    def create_payment(
+        placeholders = ", ".join("?" * len(user_ids))
+        rows = await self.conn.execute_fetchall(
+            f"SELECT * FROM users WHERE id IN ({placeholders})", user_ids
+        )
+        return {row["id"]: row for row in rows}
+
+    async def create_payment(
         self,
         user_id: int,
         jalali_month: int,
         jalali_year: int,
         status: str = PaymentStatus.PENDING,
+        image_path: Optional[str] = None,
     ) -> int:
-        """Create a payment record."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        """Create a payment record.
+
+        image_path holds the Telegram file_id of the uploaded receipt.
+        """
+        async with self.conn.execute(
             """
-            INSERT INTO payments (user_id, jalali_month, jalali_year, status)
-            VALUES (?, ?, ?, ?)
+            INSERT INTO payments (user_id, jalali_month, jalali_year, status, image_path)
+            VALUES (?, ?, ?, ?, ?)
+            RETURNING id
             """,
-            (user_id, jalali_month, jalali_year, status),
-        )
-        self.conn.commit()
-        return cursor.lastrowid
+            (user_id, jalali_month, jalali_year, status, image_path),
+        ) as cursor:
+            row = await cursor.fetchone()
+        self._history_cache.pop(user_id, None)
+        return row[0]
 
-    def update_payment_status(
+    async def update_payment_status(
         self, payment_id: int, status: str, image_path: Optional[str] = None
     ) -> None:
         """Update payment status."""
-        cursor = self.conn.cursor()
         if image_path:
-            cursor.execute(
+            rows = await self.conn.execute_fetchall(
                 """
                 UPDATE payments SET status = ?, image_path = ?, updated_at = ?
                 WHERE id = ?
+                RETURNING user_id
                 """,
                 (status, image_path, datetime.now(), payment_id),
             )
         else:
-            cursor.execute(
+            rows = await self.conn.execute_fetchall(
                 """
                 UPDATE payments SET status = ?, updated_at = ?
                 WHERE id = ?
+                RETURNING user_id
                 """,
                 (status, datetime.now(), payment_id),
             )
-        self.conn.commit()
+        self._invalidate_history(row[0] for row in rows)
+
+    async def update_payment_statuses(self, updates: dict[int, str]) -> None:
+        """Set the status of several payments ({payment_id: status}) in one UPDATE."""
+        if not updates:
+            return
 
-    def get_pending_payments(
+        cases = " ".join("WHEN ? THEN ?" for _ in updates)
+        placeholders = ", ".join("?" * len(updates))
+        params: list = []
+        for payment_id, status in updates.items():
+            params += (payment_id, status)
+        rows = await self.conn.execute_fetchall(
+            f"""
+            UPDATE payments SET status = CASE id {cases} END, updated_at = ?
+            WHERE id IN ({placeholders})
+            RETURNING user_id
+            """,
+            (*params, datetime.now(), *updates),
+        )
+        self._invalidate_history(row[0] for row in rows)
+
+    def _invalidate_history(self, user_ids) -> None:
+        """Drop cached payment history for users whose payments changed."""
+        for user_id in user_ids:
+            self._history_cache.pop(user_id, None)
+
+    async def get_payment_history(self, user_id: int) -> list[sqlite3.Row]:
+        """Get (jalali_month, jalali_year, status) of a user's payments, newest first."""
+        history = self._history_cache.get(user_id)
+        if history is not None:
+            self._history_cache.move_to_end(user_id)
+            return history
+
+        history = list(
+            await self.conn.execute_fetchall(
+                """
+                SELECT jalali_month, jalali_year, status FROM payments
+                WHERE user_id = ?
+                ORDER BY jalali_year DESC, jalali_month DESC
+                """,
+                (user_id,),
+            )
+        )
+        self._history_cache[user_id] = history
+        if len(self._history_cache) > HISTORY_CACHE_SIZE:
+            self._history_cache.popitem(last=False)
+        return history
+
+    async def get_payment_recipients(self, payment_ids) -> dict[int, int]:
+        """Map payment IDs to the Telegram ID of the paying user (if bound)."""
+        payment_ids = list(payment_ids)
+        if not payment_ids:
+            return {}
+
+        placeholders = ", ".join("?" * len(payment_ids))
+        rows = await self.conn.execute_fetchall(
+            f"""
+            SELECT p.id, u.telegram_id FROM payments p
+            JOIN users u ON u.id = p.user_id
+            WHERE p.id IN ({placeholders}) AND u.telegram_id IS NOT NULL
+            """,
+            payment_ids,
+        )
+        return {row[0]: row[1] for row in rows}
+
+    async def get_pending_payments(
         self, jalali_month: int, jalali_year: int
-    ) -> list[dict]:
+    ) -> list[sqlite3.Row]:
         """Get pending or failed payments for a month."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        return await self.conn.execute_fetchall(
             """
             SELECT p.* FROM payments p
             WHERE p.jalali_month = ? AND p.jalali_year = ?
@@ -258,77 +456,83 @@ class Database:
             """,
             (jalali_month, jalali_year, PaymentStatus.PENDING, PaymentStatus.FAILED),
         )
-        return [dict(row) for row in cursor.fetchall()]
 
-    def get_all_verified_users(self) -> list[dict]:
+    async def get_all_verified_users(self) -> list[sqlite3.Row]:
         """Get all users with a bound Telegram ID (contactable users)."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        return await self.conn.execute_fetchall(
             "SELECT * FROM users WHERE telegram_id IS NOT NULL"
         )
-        return [dict(row) for row in cursor.fetchall()]
 
-    def get_pending_admin_users(self) -> list[dict]:
+    async def get_all_verified_telegram_ids(self) -> list[int]:
+        """Get the Telegram IDs of all contactable users."""
+        rows = await self.conn.execute_fetchall(
+            "SELECT telegram_id FROM users WHERE telegram_id IS NOT NULL"
+        )
+        return [row[0] for row in rows]
+
+    async def get_pending_admin_users(self) -> list[sqlite3.Row]:
         """Get users pending admin approval."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        return await self.conn.execute_fetchall(
             "SELECT * FROM users WHERE status = ?", (UserStatus.PENDING_ADMIN,)
         )
-        return [dict(row) for row in cursor.fetchall()]
 
-    def create_pending_approval(self, user_id: int) -> int:
+    async def create_pending_approval(self, user_id: int) -> int:
         """Create pending approval record."""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "INSERT INTO pending_approvals (user_id) VALUES (?)", (user_id,)
-        )
-        self.conn.commit()
-        return cursor.lastrowid
+        async with self.conn.execute(
+            "INSERT INTO pending_approvals (user_id) VALUES (?) RETURNING id", (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0]
 
-    def get_pending_approval(self, approval_id: int) -> Optional[dict]:
+    async def get_pending_approval(self, approval_id: int) -> Optional[dict]:
         """Get pending approval by ID."""
-        cursor = self.conn.cursor()
-        cursor.execute(
+        async with self.conn.execute(
             "SELECT * FROM pending_approvals WHERE id = ?", (approval_id,)
-        )
-        row = cursor.fetchone()
+        ) as cursor:
+            row = await cursor.fetchone()
         return dict(row) if row else None
 
-    def approve_user(self, user_id: int) -> None:
+    async def approve_user(self, user_id: int) -> None:
         """Approve user."""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
+        await self.approve_users([user_id])
+
+    async def approve_users(self, user_ids: list[int]) -> None:
+        """Approve several users with a single UPDATE."""
+        if not user_ids:
+            return
+
+        placeholders = ", ".join("?" * len(user_ids))
+        await self.conn.execute(
+            f"""
             UPDATE users SET status = ?, updated_at = ?
-            WHERE id = ?
+            WHERE id IN ({placeholders})
             """,
-            (UserStatus.VERIFIED, datetime.now(), user_id),
+            (UserStatus.VERIFIED, datetime.now(), *user_ids),
         )
-        self.conn.commit()
+        for user_id in user_ids:
+            self._invalidate_cached_user(user_id)
 
-    def get_monthly_summary(self, jalali_month: int, jalali_year: int) -> dict:
+    async def get_monthly_summary(self, jalali_month: int, jalali_year: int) -> dict:
         """Get monthly payment summary."""
-        cursor = self.conn.cursor()
-
         # Get all users and their payment status
-        cursor.execute(
-            """
-            SELECT 
-                u.full_name,
-                u.donation_amount,
-                COALESCE(p.status, ?) as payment_status
-            FROM users u
-            LEFT JOIN payments p ON u.id = p.user_id
-                AND p.jalali_month = ? AND p.jalali_year = ?
-            WHERE u.telegram_id IS NOT NULL
-            ORDER BY u.full_name
-            """,
+        rows = await self.conn.execute_fetchall(
+            MONTHLY_SUMMARY_QUERY,
             (PaymentStatus.PENDING, jalali_month, jalali_year),
         )
 
-        rows = cursor.fetchall()
         return {
-            "data": [dict(row) for row in rows],
+            "data": rows,
             "month": jalali_month,
             "year": jalali_year,
         }
+
+    async def iter_monthly_summary(
+        self, jalali_month: int, jalali_year: int
+    ) -> AsyncIterator[sqlite3.Row]:
+        """Yield monthly summary rows one at a time instead of materializing them."""
+        async with self.conn.execute(
+            MONTHLY_SUMMARY_QUERY,
+            (PaymentStatus.PENDING, jalali_month, jalali_year),
+        ) as cursor:
+            async for row in cursor:
+                yield row
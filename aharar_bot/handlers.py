@@ -1,14 +1,33 @@
 """Handlers for user interactions."""
 
 from typing import Optional
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import (
+    Update,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+)
+from telegram.constants import MessageLimit
 from telegram.ext import ContextTypes, ConversationHandler
 
 from .database import Database
 from .config import UserStatus, PaymentStatus, ADMIN_CHAT_ID
 from .models import UserModel
-from .utils import MessageFormatter, JalaliCalendar
-from .scheduler import send_donation_notification, send_reminder_notification
+from .utils import (
+    MessageFormatter,
+    JalaliCalendar,
+    normalize_pin,
+    encode_payment_callback,
+    CALLBACK_APPROVE,
+    CALLBACK_DENY,
+)
+from .scheduler import (
+    send_donation_notification,
+    send_reminder_notification,
+    deliver_monthly_report,
+    send_bulk,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,7 +37,12 @@ PIN_CODE = 0
 VERIFICATION = 1
 MAIN_MENU = 2
 
-db = Database()
+# Payment status labels shown in /history
+PAYMENT_STATUS_TEXT: dict[str, str] = {
+    PaymentStatus.APPROVED: "✅ تأیید شده",
+    PaymentStatus.PENDING: "⏳ در انتظار",
+    PaymentStatus.FAILED: "❌ رد شده",
+}
 
 
 async def log_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -53,11 +77,12 @@ async def global_error_handler(update: Optional[Update], context: ContextTypes.D
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start command handler."""
+    db: Database = context.bot_data["db"]
     user = update.effective_user
     telegram_id = user.id
 
     # Check if user already associated with this Telegram ID
-    existing_user = db.get_user_by_telegram_id(telegram_id)
+    existing_user = await db.get_user_by_telegram_id(telegram_id)
     if existing_user:
         # If Telegram ID is already bound, directly show the main menu
         await show_main_menu(update, context)
@@ -72,29 +97,15 @@ async def handle_pin_code(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
     """Handle PIN code input."""
+    db: Database = context.bot_data["db"]
     pin_code = update.message.text.strip()
 
     # Normalize and validate pin code
-    from .utils import normalize_pin
-
     normalized = normalize_pin(pin_code)
     logger.info("PIN input: '%s' → normalized: '%s'", pin_code, normalized)
 
-    user = db.get_user_by_pin(normalized)
-
-    # Fallback: if numeric and not found, try matching by numeric value ignoring leading zeros
-    if not user and normalized.isdigit():
-        cursor = db.conn.cursor()
-        cursor.execute("SELECT * FROM users")
-        rows = cursor.fetchall()
-        for row in rows:
-            db_pin = (row["pin_code"] or "").strip()
-            try:
-                if db_pin.isdigit() and int(db_pin) == int(normalized):
-                    user = dict(row)
-                    break
-            except ValueError:
-                continue
+    # Falls back to numeric matching ignoring leading zeros
+    user = await db.get_user_by_pin(normalized)
 
     if not user:
         logger.warning("PIN lookup failed for input: %s (normalized: %s)", pin_code, normalized)
@@ -124,6 +135,7 @@ async def handle_verification(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> int:
     """Handle user verification."""
+    db: Database = context.bot_data["db"]
     response = update.message.text.strip()
 
     if response == "بله":
@@ -132,7 +144,7 @@ async def handle_verification(
         full_name = context.user_data["full_name"]
 
         # Update user with Telegram ID (do not modify status)
-        db.update_user_telegram_id(user_id, telegram_id)
+        await db.update_user_telegram_id(user_id, telegram_id)
 
         # Send success message
         success_msg = MessageFormatter.format_success_message(
@@ -188,9 +200,8 @@ async def handle_card_number(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle card number request."""
-    card_number = "۶۲۲۱۰۶۱۲۳۷۷۵۷۰۸۵"
     await update.message.reply_text(
-        f"شماره کارت خیریه (با لمس کردن کپی می شود):\n`{card_number}`",
+        f"شماره کارت خیریه (با لمس کردن کپی می شود):\n`{MessageFormatter.CARD_NUMBER}`",
         parse_mode="Markdown",
     )
 
@@ -199,8 +210,9 @@ async def handle_donation_link(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle donation link request."""
+    db: Database = context.bot_data["db"]
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user = await db.get_user_by_telegram_id(telegram_id)
 
     if user:
         await update.message.reply_text(
@@ -214,8 +226,9 @@ async def handle_donation_amount(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle donation amount request."""
+    db: Database = context.bot_data["db"]
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user = await db.get_user_by_telegram_id(telegram_id)
 
     if user:
         await update.message.reply_text(
@@ -233,8 +246,9 @@ async def handle_payment_upload(
     Supports both `/upload` command (prompts for a photo) and direct photo
     messages (process immediately) from verified users.
     """
+    db: Database = context.bot_data["db"]
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user = await db.get_user_by_telegram_id(telegram_id)
 
     if not user:
         await update.message.reply_text("کاربری یافت نشد.")
@@ -251,21 +265,14 @@ async def handle_payment_upload(
     # Clear awaiting flag
     context.user_data.pop("awaiting_photo", None)
 
-    # Get the highest quality photo
+    # Get the highest quality photo; Telegram keeps it, so only its file_id is stored
     photo = update.message.photo[-1]
-    file = await context.bot.get_file(photo.file_id)
-
-    # Ensure payments directory exists
-    import os
-    os.makedirs("payments", exist_ok=True)
-
-    # Save photo
-    file_path = f"payments/{user['id']}_{photo.file_id}.jpg"
-    await file.download_to_drive(file_path)
 
     # Create payment record
     j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-    payment_id = db.create_payment(user["id"], j_m, j_y, PaymentStatus.PENDING)
+    payment_id = await db.create_payment(
+        user["id"], j_m, j_y, PaymentStatus.PENDING, image_path=photo.file_id
+    )
 
     # Notify admin (ensure ADMIN_CHAT_ID is configured)
     if not ADMIN_CHAT_ID or ADMIN_CHAT_ID == 0:
@@ -279,24 +286,25 @@ async def handle_payment_upload(
         f"پرداخت جدید برای تأیید:\n\n"
         f"نام: {user['full_name']}\n"
         f"مبلغ: {user['donation_amount']}\n"
-        f"شناسه پرداخت: {payment_id}"
+        f"شناسه پرداخت: {payment_id}\n\n"
+        f"لطفا تصویر را تأیید یا رد کنید:"
     )
 
-    await context.bot.send_message(ADMIN_CHAT_ID, admin_msg)
-    await context.bot.send_photo(ADMIN_CHAT_ID, photo.file_id)
-
-    # Add inline buttons for admin approval
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
+    # Send details, photo and approval buttons to admin as a single message
     keyboard = [
         [
-            InlineKeyboardButton("تأیید", callback_data=f"approve_{payment_id}"),
-            InlineKeyboardButton("رد کردن", callback_data=f"deny_{payment_id}"),
+            InlineKeyboardButton(
+                "تأیید", callback_data=encode_payment_callback(CALLBACK_APPROVE, payment_id)
+            ),
+            InlineKeyboardButton(
+                "رد کردن", callback_data=encode_payment_callback(CALLBACK_DENY, payment_id)
+            ),
         ]
     ]
-    await context.bot.send_message(
+    await context.bot.send_photo(
         ADMIN_CHAT_ID,
-        "لطفا تصویر را تأیید یا رد کنید:",
+        photo.file_id,
+        caption=admin_msg,
         reply_markup=InlineKeyboardMarkup(keyboard),
     )
 
@@ -311,99 +319,89 @@ async def handle_payment_history(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
     """Handle payment history request."""
+    db: Database = context.bot_data["db"]
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user_id = await db.get_user_id_by_telegram_id(telegram_id)
 
-    if not user:
+    if not user_id:
         await update.message.reply_text("کاربری یافت نشد.")
         return
 
     # Get payment history
-    cursor = db.conn.cursor()
-    cursor.execute(
-        """
-        SELECT jalali_month, jalali_year, status FROM payments
-        WHERE user_id = ?
-        ORDER BY jalali_year DESC, jalali_month DESC
-        """,
-        (user["id"],),
-    )
-    payments = cursor.fetchall()
+    payments = await db.get_payment_history(user_id)
 
     if not payments:
         await update.message.reply_text("سابقه‌ای برای شما وجود ندارد.")
         return
 
-    history_text = "سابقه پرداخت‌های من:\n\n"
+    history_lines = ["سابقه پرداخت‌های من:\n"]
     for payment in payments:
         month_name = JalaliCalendar.format_jalali_date(payment[1], payment[0], 1)
-        status_text = {
-            PaymentStatus.APPROVED: "✅ تأیید شده",
-            PaymentStatus.PENDING: "⏳ در انتظار",
-            PaymentStatus.FAILED: "❌ رد شده",
-        }.get(payment[2], "نامشخص")
-
-        history_text += f"{month_name}: {status_text}\n"
+        status_text = PAYMENT_STATUS_TEXT.get(payment[2], "نامشخص")
+        history_lines.append(f"{month_name}: {status_text}")
 
-    await update.message.reply_text(history_text)
+    await update.message.reply_text("\n".join(history_lines))
 
 
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Logout the current user (disassociate Telegram ID)."""
+    db: Database = context.bot_data["db"]
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user = await db.get_user_by_telegram_id(telegram_id)
 
     if not user:
         # Use reply_markup to ensure this is sent as a reply; handle clients that don't support reply_text return value
         await update.message.reply_text("شما در سیستم وارد نشده‌اید.", reply_markup=ReplyKeyboardRemove())
         return ConversationHandler.END
 
-    db.logout_user_by_telegram_id(telegram_id)
+    await db.logout_user_by_telegram_id(telegram_id)
     # Clear any per-user session data and remove keyboard
     context.user_data.clear()
     await update.message.reply_text("شما با موفقیت از حساب خارج شدید.", reply_markup=ReplyKeyboardRemove())
     return ConversationHandler.END
 
 
+# User commands that require a verified account, mapped to their handlers
+PROTECTED_COMMANDS = {
+    "card": handle_card_number,
+    "link": handle_donation_link,
+    "amount": handle_donation_amount,
+    "upload": handle_payment_upload,
+    "history": handle_payment_history,
+}
+
+
 async def handle_protected_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Dispatch wrapper for user commands that requires the user to be VERIFIED.
 
     Supported commands: /card, /link, /amount, /upload, /history
     If user isn't verified, prompts them to run /start and complete verification.
     """
+    db: Database = context.bot_data["db"]
     text = (update.message.text or "").strip()
     if not text.startswith("/"):
         return
 
     cmd = text.split()[0].lstrip("/").split("@")[0].lower()
+    handler = PROTECTED_COMMANDS.get(cmd)
+    if not handler:
+        # Unknown command; do nothing
+        return
 
     telegram_id = update.effective_user.id
-    user = db.get_user_by_telegram_id(telegram_id)
+    user = await db.get_user_by_telegram_id(telegram_id)
     if not user:
         await update.message.reply_text(
             "لطفاً ابتدا با /start وارد شوید و پین خود را وارد کنید تا از دستورات استفاده کنید."
         )
         return
 
-    # Map command to existing handlers
-    mapping = {
-        "card": handle_card_number,
-        "link": handle_donation_link,
-        "amount": handle_donation_amount,
-        "upload": handle_payment_upload,
-        "history": handle_payment_history,
-    }
-
-    handler = mapping.get(cmd)
-    if handler:
-        await handler(update, context)
-    else:
-        # Unknown command; do nothing
-        return
+    await handler(update, context)
 
 
 async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Admin command to view current month's payment statuses."""
+    db: Database = context.bot_data["db"]
     user_id = update.effective_user.id
     logger.info("report_command: user_id=%s, ADMIN_CHAT_ID=%s, match=%s", user_id, ADMIN_CHAT_ID, user_id == ADMIN_CHAT_ID)
     
@@ -412,17 +410,35 @@ async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-    summary = db.get_monthly_summary(j_m, j_y)
 
+    # Build the report while streaming rows, splitting at Telegram's message limit
     msg_lines = [f"گزارش ماه {j_m} سال {j_y}:\n"]
-    for row in summary["data"]:
-        status = row.get("payment_status")
-        emoji = "✅" if status == PaymentStatus.APPROVED else "❌"
-        msg_lines.append(f"{emoji} {row['full_name']} — {row['donation_amount']}")
+    msg_length = len(msg_lines[0])
+    async for row in db.iter_monthly_summary(j_m, j_y):
+        emoji = "✅" if row["payment_status"] == PaymentStatus.APPROVED else "❌"
+        line = f"{emoji} {row['full_name']} — {row['donation_amount']}"
+        if msg_length + len(line) + 1 > MessageLimit.MAX_TEXT_LENGTH:
+            await update.message.reply_text("\n".join(msg_lines))
+            msg_lines, msg_length = [], 0
+        msg_lines.append(line)
+        msg_length += len(line) + 1
 
     await update.message.reply_text("\n".join(msg_lines))
 
 
+async def _broadcast(context: ContextTypes.DEFAULT_TYPE, text: str) -> int:
+    """Send text to all verified users, returning how many messages were delivered.
+
+    Uses the same rate limiter and 429 retry as the scheduled notifications.
+    """
+    db: Database = context.bot_data["db"]
+    telegram_ids = await db.get_all_verified_telegram_ids()
+    failures = await send_bulk(
+        context.bot, [(telegram_id, text) for telegram_id in telegram_ids], "broadcast"
+    )
+    return len(telegram_ids) - len(failures)
+
+
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Admin command to broadcast a message to all verified users.
 
@@ -444,16 +460,7 @@ async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     # Non-interactive: send immediately
-    users = db.get_all_verified_users()
-    sent = 0
-    for user in users:
-        if not user.get("telegram_id"):
-            continue
-        try:
-            await context.bot.send_message(user["telegram_id"], text)
-            sent += 1
-        except Exception as e:
-            logger.error("Failed to send broadcast to %s: %s", user['full_name'], e)
+    sent = await _broadcast(context, text)
 
     await update.message.reply_text(f"پیام شما به {sent} کاربر ارسال شد.")
 
@@ -474,16 +481,7 @@ async def handle_pending_admin_broadcast(update: Update, context: ContextTypes.D
         await update.message.reply_text("متن پیام خالی است، لطفا یک پیام معتبر ارسال کنید یا /cancel بزنید.")
         return
 
-    users = db.get_all_verified_users()
-    sent = 0
-    for user in users:
-        if not user.get("telegram_id"):
-            continue
-        try:
-            await context.bot.send_message(user["telegram_id"], text)
-            sent += 1
-        except Exception as e:
-            logger.error("Failed to send broadcast to %s: %s", user['full_name'], e)
+    sent = await _broadcast(context, text)
 
     # Clear the awaiting flag
     context.user_data.pop("awaiting_broadcast", None)
@@ -491,6 +489,13 @@ async def handle_pending_admin_broadcast(update: Update, context: ContextTypes.D
     await update.message.reply_text(f"پیام شما به {sent} کاربر ارسال شد.")
 
 
+async def main_menu_dispatch(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    """Route plain text in the main menu: a pending admin broadcast, otherwise the menu."""
+    if context.user_data.get("awaiting_broadcast"):
+        return await handle_pending_admin_broadcast(update, context)
+    return await show_main_menu(update, context)
+
+
 async def manual_trigger(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Admin command to manually trigger scheduled tasks.
 
@@ -514,24 +519,8 @@ async def manual_trigger(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif cmd == "report":
         # Generate and send report immediately (bypass date check)
         j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-        summary = db.get_monthly_summary(j_m, j_y)
-        from .scheduler import create_excel_report, create_pdf_report
-
-        excel_path = await create_excel_report(summary)
-        pdf_path = await create_pdf_report(summary)
-
-        try:
-            with open(excel_path, "rb") as excel_file:
-                await context.bot.send_document(ADMIN_CHAT_ID, excel_file, filename=f"گزارش_ماه_{j_m}_{j_y}.xlsx")
-            with open(pdf_path, "rb") as pdf_file:
-                await context.bot.send_document(ADMIN_CHAT_ID, pdf_file, filename=f"گزارش_ماه_{j_m}_{j_y}.pdf")
-            await update.message.reply_text("گزارش ماهانه ارسال شد.")
-        finally:
-            import os
-            if os.path.exists(excel_path):
-                os.remove(excel_path)
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
+        await deliver_monthly_report(context, j_m, j_y)
+        await update.message.reply_text("گزارش ماهانه ارسال شد.")
     else:
         await update.message.reply_text("گزینه نامعتبر. از donation|reminder|report استفاده کنید.")
 
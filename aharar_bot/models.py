@@ -1,6 +1,6 @@
 """Pydantic models for data validation."""
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 from datetime import datetime
 
@@ -8,6 +8,8 @@ from datetime import datetime
 class UserModel(BaseModel):
     """User model."""
 
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+
     id: Optional[int] = None
     pin_code: str = Field(..., min_length=1, max_length=10)
     full_name: str = Field(..., min_length=1, max_length=255)
@@ -18,15 +20,12 @@ class UserModel(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
-    class Config:
-        """Model configuration."""
-
-        from_attributes = True
-
 
 class PaymentModel(BaseModel):
     """Payment model."""
 
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+
     id: Optional[int] = None
     user_id: int
     jalali_month: int = Field(..., ge=1, le=12)
@@ -36,28 +35,13 @@ class PaymentModel(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
-    @validator("jalali_month")
-    def validate_month(cls, v: int) -> int:
-        """Validate Jalali month."""
-        if not (1 <= v <= 12):
-            raise ValueError("Month must be between 1 and 12")
-        return v
-
-    class Config:
-        """Model configuration."""
-
-        from_attributes = True
-
 
 class PendingApprovalModel(BaseModel):
     """Pending approval model."""
 
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+
     id: Optional[int] = None
     user_id: int
     status: str = Field(default="pending")
     created_at: Optional[datetime] = None
-
-    class Config:
-        """Model configuration."""
-
-        from_attributes = True
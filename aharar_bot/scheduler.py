@@ -1,64 +1,175 @@
 """Scheduler tasks for notifications and reports."""
 
-import os
+import asyncio
+import logging
+import time
 from datetime import datetime
-import pytz
+from operator import itemgetter
 from pathlib import Path
-import openpyxl
+from typing import Optional
+import xlsxwriter
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib import colors
+from aiolimiter import AsyncLimiter
+from telegram import Bot, CallbackQuery
+from telegram.error import RetryAfter
 from telegram.ext import ContextTypes
 
 from .database import Database
 from .config import TIMEZONE, NOTIFICATION_DAY, REMINDER_DAY, REPORT_DAY, UserStatus, PaymentStatus, ADMIN_CHAT_ID, JALALI_MONTHS
 from .utils import JalaliCalendar, MessageFormatter
 
-db = Database()
+logger = logging.getLogger(__name__)
+
+REPORT_HEADERS = ("نام و نام خانوادگی", "مبلغ تعهدی", "وضعیت پرداخت")
+# Pulls the report columns out of a summary row in one C-level call
+_report_row = itemgetter("full_name", "donation_amount", "payment_status")
+
+# Built once; getSampleStyleSheet() constructs a fresh style tree on every call
+_PDF_TITLE_STYLE = getSampleStyleSheet()["Heading1"]
+_PDF_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, 0), 14),
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
+    ("BACKGROUND", (0, 1), (-1, -1), colors.beige),
+    ("GRID", (0, 0), (-1, -1), 1, colors.black),
+])
+
+# Concurrent sends per fan-out, kept just under Telegram's ~30 msg/s bot-wide cap
+NOTIFICATION_CONCURRENCY = 25
+# Shared by every scheduled fan-out so overlapping jobs don't add up past the cap
+NOTIFICATION_LIMITER = AsyncLimiter(NOTIFICATION_CONCURRENCY, 1)
+# Monotonic time until which all senders hold off after a 429 (RetryAfter)
+_paused_until = 0.0
+
+# Persian names of the scheduled fan-outs, used in the admin failure summary
+NOTIFICATION_KIND_LABELS = {
+    "notification": "اطلاع‌رسانی",
+    "reminder": "یادآوری",
+}
+
+
+async def _send_rate_limited(bot: Bot, telegram_id: int, text: str) -> None:
+    """Send one message through the shared limiter, retrying once after a 429."""
+    global _paused_until
+
+    for attempt in range(2):
+        delay = _paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        async with NOTIFICATION_LIMITER:
+            try:
+                await bot.send_message(telegram_id, text)
+                return
+            except RetryAfter as e:
+                if attempt:
+                    raise
+                # Pause every sender, not just this one, until Telegram lets us back in
+                _paused_until = max(_paused_until, time.monotonic() + float(e.retry_after))
+
+
+async def send_bulk(bot: Bot, messages: list[tuple[int, str]], kind: str) -> list[int]:
+    """Send (telegram_id, text) messages concurrently through the shared limiter.
+
+    Every bulk send (scheduled fan-outs and admin broadcasts) goes through here so
+    they share one rate limit. Returns the Telegram IDs whose send failed.
+    """
+    sem = asyncio.Semaphore(NOTIFICATION_CONCURRENCY)
+    failures: list[int] = []
+
+    async def _send_one(telegram_id: int, text: str) -> None:
+        async with sem:
+            try:
+                await _send_rate_limited(bot, telegram_id, text)
+            except Exception:
+                logger.exception("Failed to send %s to uid=%s", kind, telegram_id)
+                failures.append(telegram_id)
+
+    await asyncio.gather(*(_send_one(*message) for message in messages), return_exceptions=True)
+    return failures
+
+
+async def _send_notifications(
+    context: ContextTypes.DEFAULT_TYPE, messages: list[tuple[int, str, str]], kind: str
+) -> None:
+    """Send (telegram_id, text, full_name) messages via send_bulk.
+
+    Failed sends are logged individually and reported to the admin in one summary.
+    """
+    failures = await send_bulk(
+        context.bot, [(telegram_id, text) for telegram_id, text, _ in messages], kind
+    )
+
+    if failures:
+        names = {telegram_id: full_name for telegram_id, _, full_name in messages}
+        logger.warning(
+            "%s failed for %d of %d users: %s",
+            kind,
+            len(failures),
+            len(messages),
+            ", ".join(f"uid={telegram_id} ({names[telegram_id]})" for telegram_id in failures),
+        )
+        try:
+            await context.bot.send_message(
+                ADMIN_CHAT_ID,
+                f"⚠️ ارسال {NOTIFICATION_KIND_LABELS[kind]}: "
+                f"{len(failures)} از {len(messages)} پیام ناموفق بود.",
+            )
+        except Exception:
+            logger.exception("Failed to send %s failure summary to admin", kind)
 
 
 async def send_donation_notification(context: ContextTypes.DEFAULT_TYPE, bypass_date_check: bool = False) -> None:
     """Send donation notification on the 3rd of each month."""
-    j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-    
     # Only send if today is the notification day (unless bypassed for manual trigger)
-    _, _, current_day = JalaliCalendar.get_current_jalali_date()
-    if not bypass_date_check and current_day != NOTIFICATION_DAY:
+    _, _, j_d = JalaliCalendar.get_current_jalali_date()
+    if not bypass_date_check and j_d != NOTIFICATION_DAY:
         return
 
-    verified_users = db.get_all_verified_users()
-    
-    for user in verified_users:
-        if not user.get("telegram_id"):
-            continue
+    db: Database = context.bot_data["db"]
 
-        message = MessageFormatter.format_donation_reminder(
+    verified_users = await db.get_all_verified_users()
+    
+    messages = [
+        (
+            user["telegram_id"],
+            MessageFormatter.format_donation_reminder(
+                user["full_name"],
+                user["donation_amount"],
+                user["donation_link"],
+            ),
             user["full_name"],
-            user["donation_amount"],
-            user["donation_link"],
         )
+        for user in verified_users
+        if user["telegram_id"]
+    ]
 
-        try:
-            await context.bot.send_message(user["telegram_id"], message)
-        except Exception as e:
-            print(f"Error sending notification to {user['full_name']}: {e}")
+    await _send_notifications(context, messages, "notification")
 
 
 async def send_reminder_notification(context: ContextTypes.DEFAULT_TYPE, bypass_date_check: bool = False) -> None:
     """Send reminder notification for pending payments on the 7th of each month."""
-    j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-    
     # Only send if today is the reminder day (unless bypassed for manual trigger)
-    _, _, current_day = JalaliCalendar.get_current_jalali_date()
-    if not bypass_date_check and current_day != REMINDER_DAY:
+    j_y, j_m, j_d = JalaliCalendar.get_current_jalali_date()
+    if not bypass_date_check and j_d != REMINDER_DAY:
         return
 
-    pending_payments = db.get_pending_payments(j_m, j_y)
+    db: Database = context.bot_data["db"]
+
+    pending_payments = await db.get_pending_payments(j_m, j_y)
     
+    users = await db.get_users_by_ids({payment["user_id"] for payment in pending_payments})
+
+    messages = []
     for payment in pending_payments:
-        user = db.get_user_by_id(payment["user_id"])
-        if not user or not user.get("telegram_id"):
+        user = users.get(payment["user_id"])
+        if not user or not user["telegram_id"]:
             continue
 
         message = (
@@ -67,126 +178,140 @@ async def send_reminder_notification(context: ContextTypes.DEFAULT_TYPE, bypass_
             f"لطفا در اسرع وقت درخواست خود را انجام دهید.\n\n"
             f"لینک پرداخت: {user['donation_link']}"
         )
+        messages.append((user["telegram_id"], message, user["full_name"]))
+
+    await _send_notifications(context, messages, "reminder")
 
-        try:
-            await context.bot.send_message(user["telegram_id"], message)
-        except Exception as e:
-            print(f"Error sending reminder to {user['full_name']}: {e}")
+
+# Morning jobs keyed by the Jalali day they run on
+_MORNING_JOBS = {
+    NOTIFICATION_DAY: send_donation_notification,
+    REMINDER_DAY: send_reminder_notification,
+}
+
+
+async def run_morning_jobs(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Daily 9:00 tick: run whichever morning job is due today, if any."""
+    _, _, j_d = JalaliCalendar.get_current_jalali_date()
+    job = _MORNING_JOBS.get(j_d)
+    if job:
+        await job(context, bypass_date_check=True)
 
 
 async def send_monthly_report(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send monthly report (Excel and PDF) on the 10th of each month."""
-    _, _, current_day = JalaliCalendar.get_current_jalali_date()
-    if current_day != REPORT_DAY:
+    j_y, j_m, j_d = JalaliCalendar.get_current_jalali_date()
+    if j_d != REPORT_DAY:
         return
 
-    j_m, j_y = JalaliCalendar.get_current_jalali_month_year()
-    
-    # Get monthly summary
-    summary = db.get_monthly_summary(j_m, j_y)
-    
-    # Create Excel file
-    excel_path = await create_excel_report(summary)
-    
-    # Create PDF file
-    pdf_path = await create_pdf_report(summary)
-    
-    # Send files to admin
     try:
-        with open(excel_path, "rb") as excel_file:
-            await context.bot.send_document(
+        await deliver_monthly_report(context, j_m, j_y)
+    except Exception:
+        logger.exception("Failed to send monthly report")
+
+
+async def deliver_monthly_report(context: ContextTypes.DEFAULT_TYPE, j_m: int, j_y: int) -> None:
+    """Build the Excel and PDF reports for a month and send both to the admin."""
+    db: Database = context.bot_data["db"]
+    summary = await db.get_monthly_summary(j_m, j_y)
+    excel_path = _report_path(j_y, j_m, "xlsx")
+    pdf_path = _report_path(j_y, j_m, "pdf")
+
+    try:
+        # Let both builders finish before re-raising, so neither writes after cleanup
+        results = await asyncio.gather(
+            create_excel_report(summary),
+            create_pdf_report(summary),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        # PTB reads the files itself when given a path; upload both at once
+        await asyncio.gather(
+            context.bot.send_document(
                 ADMIN_CHAT_ID,
-                excel_file,
+                Path(excel_path),
                 filename=f"گزارش_ماه_{j_m}_{j_y}.xlsx",
-            )
-
-        with open(pdf_path, "rb") as pdf_file:
-            await context.bot.send_document(
+            ),
+            context.bot.send_document(
                 ADMIN_CHAT_ID,
-                pdf_file,
+                Path(pdf_path),
                 filename=f"گزارش_ماه_{j_m}_{j_y}.pdf",
-            )
-    except Exception as e:
-        print(f"Error sending monthly report: {e}")
+            ),
+        )
     finally:
         # Clean up files
-        if os.path.exists(excel_path):
-            os.remove(excel_path)
-        if os.path.exists(pdf_path):
-            os.remove(pdf_path)
+        Path(excel_path).unlink(missing_ok=True)
+        Path(pdf_path).unlink(missing_ok=True)
+
+
+def _report_path(j_y: int, j_m: int, extension: str) -> str:
+    """Path a monthly report file is written to."""
+    return f"reports/monthly_report_{j_y}_{j_m}.{extension}"
 
 
 async def create_excel_report(summary: dict) -> str:
+    """Create Excel report without blocking the event loop."""
+    return await asyncio.to_thread(_create_excel_report_sync, summary)
+
+
+async def create_pdf_report(summary: dict) -> str:
+    """Create PDF report without blocking the event loop."""
+    return await asyncio.to_thread(_create_pdf_report_sync, summary)
+
+
+def _create_excel_report_sync(summary: dict) -> str:
     """Create Excel report."""
     j_m = summary["month"]
     j_y = summary["year"]
     
-    excel_path = f"reports/monthly_report_{j_y}_{j_m}.xlsx"
+    excel_path = _report_path(j_y, j_m, "xlsx")
     Path("reports").mkdir(exist_ok=True)
     
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.title = f"ماه {j_m}"
-    
+    # constant_memory streams each row to disk instead of keeping every cell alive
+    workbook = xlsxwriter.Workbook(excel_path, {"constant_memory": True})
+    worksheet = workbook.add_worksheet(f"ماه {j_m}")
+
+    # Adjust column widths
+    worksheet.set_column("A:A", 30)
+    worksheet.set_column("B:C", 15)
+
     # Add headers
-    headers = ["نام و نام خانوادگی", "مبلغ تعهدی", "وضعیت پرداخت"]
-    worksheet.append(headers)
-    
+    worksheet.write_row(0, 0, REPORT_HEADERS, workbook.add_format({"bold": True}))
+
     # Add data
-    for row in summary["data"]:
-        worksheet.append([
-            row["full_name"],
-            row["donation_amount"],
-            row["payment_status"],
-        ])
-    
-    # Adjust column widths
-    worksheet.column_dimensions["A"].width = 30
-    worksheet.column_dimensions["B"].width = 15
-    worksheet.column_dimensions["C"].width = 15
-    
-    workbook.save(excel_path)
+    for row_idx, row in enumerate(map(_report_row, summary["data"]), start=1):
+        worksheet.write_row(row_idx, 0, row)
+
+    workbook.close()
     return excel_path
 
 
-async def create_pdf_report(summary: dict) -> str:
+def _create_pdf_report_sync(summary: dict) -> str:
     """Create PDF report."""
     j_m = summary["month"]
     j_y = summary["year"]
     
-    pdf_path = f"reports/monthly_report_{j_y}_{j_m}.pdf"
+    pdf_path = _report_path(j_y, j_m, "pdf")
     Path("reports").mkdir(exist_ok=True)
     
     doc = SimpleDocTemplate(pdf_path, pagesize=letter, rightMargin=72, leftMargin=72)
     
-    styles = getSampleStyleSheet()
     story = []
     
     # Add title
-    title = Paragraph(f"گزارش ماهانه - ماه {j_m} سال {j_y}", styles["Heading1"])
+    title = Paragraph(f"گزارش ماهانه - ماه {j_m} سال {j_y}", _PDF_TITLE_STYLE)
     story.append(title)
     
     # Create table data
-    table_data = [["نام و نام خانوادگی", "مبلغ تعهدی", "وضعیت پرداخت"]]
-    for row in summary["data"]:
-        table_data.append([
-            row["full_name"],
-            row["donation_amount"],
-            row["payment_status"],
-        ])
+    table_data = [REPORT_HEADERS]
+    table_data.extend(map(_report_row, summary["data"]))
     
-    # Create table
-    table = Table(table_data)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 14),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 12),
-        ("BACKGROUND", (0, 1), (-1, -1), colors.beige),
-        ("GRID", (0, 0), (-1, -1), 1, colors.black),
-    ]))
+    # Create table; repeat the header row on every page
+    table = Table(table_data, repeatRows=1)
+    table.setStyle(_PDF_TABLE_STYLE)
     
     story.append(table)
     
@@ -194,49 +319,123 @@ async def create_pdf_report(summary: dict) -> str:
     return pdf_path
 
 
+class ApprovalAggregator:
+    """Coalesce admin payment decisions into batched writes and one message per user.
+
+    Callback handlers only enqueue ``(payment_id, status, query)``; a single worker
+    drains the queue in batches of up to ``max_batch`` items or ``max_delay`` seconds,
+    writes them with one UPDATE and edits the admin's buttons concurrently.
+    """
+
+    _STATUS_MESSAGES = {
+        PaymentStatus.APPROVED: MessageFormatter.PAYMENT_APPROVED,
+        PaymentStatus.FAILED: MessageFormatter.PAYMENT_DENIED,
+    }
+    _STATUS_CAPTIONS = {
+        PaymentStatus.APPROVED: "پرداخت تأیید شد ✅",
+        PaymentStatus.FAILED: "پرداخت رد شد ❌",
+    }
+
+    def __init__(self, db: Database, bot: Bot, max_batch: int = 200, max_delay: float = 0.25):
+        self.db = db
+        self.bot = bot
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[Optional[tuple[int, str, Optional[CallbackQuery]]]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the background worker."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush queued decisions and stop the worker.
+
+        Must run before the bot is shut down, or the final batch's messages fail.
+        """
+        if self._task:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+    def submit(self, payment_id: int, status: str, query: Optional[CallbackQuery] = None) -> None:
+        """Queue a status change for a payment, optionally with the admin's button press."""
+        self._queue.put_nowait((payment_id, status, query))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Failed to apply %d payment decisions", len(batch))
+
+            if stopping:
+                return
+
+    async def _flush(self, batch: list[tuple[int, str, Optional[CallbackQuery]]]) -> None:
+        # The admin's last click on a payment wins, for both the row and its caption
+        decisions = {payment_id: (status, query) for payment_id, status, query in batch}
+        statuses = {payment_id: status for payment_id, (status, _) in decisions.items()}
+        await self.db.update_payment_statuses(statuses)
+
+        recipients = await self.db.get_payment_recipients(statuses)
+        per_user: dict[int, list[str]] = {}
+        for payment_id, status in statuses.items():
+            telegram_id = recipients.get(payment_id)
+            if telegram_id:
+                per_user.setdefault(telegram_id, []).append(status)
+
+        await asyncio.gather(
+            *(self._notify(telegram_id, user_statuses) for telegram_id, user_statuses in per_user.items()),
+            *(self._edit_caption(query, status) for status, query in decisions.values() if query),
+        )
+
+    async def _notify(self, telegram_id: int, statuses: list[str]) -> None:
+        text = "\n\n".join(dict.fromkeys(self._STATUS_MESSAGES[status] for status in statuses))
+        try:
+            await _send_rate_limited(self.bot, telegram_id, text)
+        except Exception:
+            logger.exception("Failed to notify uid=%s about payment decision", telegram_id)
+
+    async def _edit_caption(self, query: CallbackQuery, status: str) -> None:
+        try:
+            await query.edit_message_caption(caption=self._STATUS_CAPTIONS[status])
+        except Exception:
+            logger.exception("Failed to update payment message caption")
+
+
 async def handle_payment_approval(
     update, context: ContextTypes.DEFAULT_TYPE, payment_id: int
 ) -> None:
     """Handle payment approval."""
-    payment = db.conn.cursor().execute(
-        "SELECT * FROM payments WHERE id = ?", (payment_id,)
-    ).fetchone()
-    
-    if not payment:
-        return
-    
-    user = db.get_user_by_id(payment["user_id"])
-    if not user:
-        return
-    
-    # Update payment status
-    db.update_payment_status(payment_id, PaymentStatus.APPROVED)
-    
-    # Notify user
-    if user.get("telegram_id"):
-        message = MessageFormatter.format_payment_approved()
-        await context.bot.send_message(user["telegram_id"], message)
+    aggregator: ApprovalAggregator = context.bot_data["approvals"]
+    aggregator.submit(payment_id, PaymentStatus.APPROVED, update.callback_query)
 
 
 async def handle_payment_denial(
     update, context: ContextTypes.DEFAULT_TYPE, payment_id: int
 ) -> None:
     """Handle payment denial."""
-    payment = db.conn.cursor().execute(
-        "SELECT * FROM payments WHERE id = ?", (payment_id,)
-    ).fetchone()
-    
-    if not payment:
-        return
-    
-    user = db.get_user_by_id(payment["user_id"])
-    if not user:
-        return
-    
-    # Update payment status
-    db.update_payment_status(payment_id, PaymentStatus.FAILED)
-    
-    # Notify user
-    if user.get("telegram_id"):
-        message = MessageFormatter.format_payment_denied()
-        await context.bot.send_message(user["telegram_id"], message)
+    aggregator: ApprovalAggregator = context.bot_data["approvals"]
+    aggregator.submit(payment_id, PaymentStatus.FAILED, update.callback_query)
@@ -1,20 +1,27 @@
 """Utility functions for Aharar Charity Bot."""
 
-from datetime import datetime
-import pytz
+import base64
+import binascii
+import struct
+from datetime import date, datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
 
 from .config import TIMEZONE, JALALI_MONTHS
 
 
 import jdatetime
 
+_TZ = ZoneInfo(TIMEZONE)
+
 class JalaliCalendar:
     """Jalali (Persian) calendar utilities using jdatetime."""
 
     @staticmethod
-    def gregorian_to_jalali(gregorian_date: datetime) -> tuple[int, int, int]:
-        """Convert Gregorian datetime to Jalali (j_y, j_m, j_d)."""
-        jd = jdatetime.datetime.fromgregorian(datetime=gregorian_date)
+    def gregorian_to_jalali(gregorian_date: date) -> tuple[int, int, int]:
+        """Convert Gregorian date (or datetime) to Jalali (j_y, j_m, j_d)."""
+        # Only the calendar day is needed, so skip building a full jdatetime.datetime
+        jd = jdatetime.date.fromgregorian(date=gregorian_date)
         return jd.year, jd.month, jd.day
 
     @staticmethod
@@ -27,9 +34,7 @@ class JalaliCalendar:
     @staticmethod
     def get_current_jalali_date() -> tuple[int, int, int]:
         """Get current date in Jalali calendar (year, month, day)."""
-        tz = pytz.timezone(TIMEZONE)
-        now = datetime.now(tz)
-        return JalaliCalendar.gregorian_to_jalali(now)
+        return _jalali_for(datetime.now(_TZ).date())
 
     @staticmethod
     def get_current_jalali_month_year() -> tuple[int, int]:
@@ -44,6 +49,23 @@ class JalaliCalendar:
         return f"{j_d} {month_name} {j_y}"
 
 
+@lru_cache(maxsize=8)
+def _jalali_for(gregorian_date: date) -> tuple[int, int, int]:
+    """Convert a Gregorian day to Jalali once; every caller on the same day shares it."""
+    return JalaliCalendar.gregorian_to_jalali(gregorian_date)
+
+
+# Persian and Arabic-Indic digits -> ASCII, zero-width (non-)joiners dropped
+_PIN_TRANSLATION = str.maketrans(
+    {
+        **{ch: str(i) for i, ch in enumerate("۰۱۲۳۴۵۶۷۸۹")},
+        **{ch: str(i) for i, ch in enumerate("٠١٢٣٤٥٦٧٨٩")},
+        "\u200c": None,  # zero-width non-joiner
+        "\u200b": None,  # zero-width space
+    }
+)
+
+
 def normalize_pin(pin: str) -> str:
     """Normalize PIN/identifier input.
 
@@ -54,71 +76,111 @@ def normalize_pin(pin: str) -> str:
     if not pin:
         return ""
 
-    # strip and remove zero-width/control characters
-    s = pin.strip()
-    s = s.replace("\u200c", "")  # zero-width non-joiner
-    s = s.replace("\u200b", "")  # zero-width space
+    return pin.translate(_PIN_TRANSLATION).strip()
+
 
-    # Maps for Persian and Arabic-Indic digits
-    persian_digits = "۰۱۲۳۴۵۶۷۸۹"
-    arabic_digits = "٠١٢٣٤٥٦٧٨٩"
+def pin_to_numeric(pin: str) -> int | None:
+    """Return the numeric value of a normalized PIN ignoring leading zeros.
+
+    Returns None for non-numeric PINs (or ones too long for an SQLite integer).
+    """
+    if pin.isascii() and pin.isdigit() and len(pin) <= 18:
+        return int(pin)
+    return None
 
-    result_chars: list[str] = []
-    for ch in s:
-        if ch in persian_digits:
-            result_chars.append(str(persian_digits.index(ch)))
-        elif ch in arabic_digits:
-            result_chars.append(str(arabic_digits.index(ch)))
-        else:
-            result_chars.append(ch)
 
-    normalized = "".join(result_chars)
-    # final strip of whitespace
-    return normalized.strip()
+# Payment button actions carried in callback_data
+CALLBACK_APPROVE = 1
+CALLBACK_DENY = 2
+
+# 1-byte action + 4-byte big-endian payment ID -> 8 base64url characters
+_PAYMENT_CALLBACK = struct.Struct(">BI")
+_LEGACY_CALLBACK_ACTIONS = {"approve": CALLBACK_APPROVE, "deny": CALLBACK_DENY}
+
+
+def encode_payment_callback(action: int, payment_id: int) -> str:
+    """Pack a payment button action into compact callback_data."""
+    return base64.urlsafe_b64encode(_PAYMENT_CALLBACK.pack(action, payment_id)).decode("ascii")
+
+
+def decode_payment_callback(data: str) -> tuple[int, int] | None:
+    """Unpack callback_data into (action, payment_id), or None if it isn't a payment button.
+
+    Also accepts the older "approve_<id>" / "deny_<id>" format still present on
+    buttons sent before the packed encoding.
+    """
+    try:
+        return _PAYMENT_CALLBACK.unpack(base64.urlsafe_b64decode(data))
+    except (binascii.Error, struct.error, ValueError):
+        pass
+
+    name, _, payment_id = data.partition("_")
+    action = _LEGACY_CALLBACK_ACTIONS.get(name)
+    if action is None or not payment_id.isdecimal():
+        return None
+    return action, int(payment_id)
 
 
 class MessageFormatter:
     """Message formatting utilities."""
 
+    CARD_NUMBER = "۶۲۲۱۰۶۱۲۳۷۷۵۷۰۸۵"
+
+    # Fixed messages and message tails, built once when the class is defined
+    PIN_REQUEST = "سلام\nلطفا کد معرف‌تون رو بفرستید (مثلا 021)"
+    INVALID_PIN = (
+        "کد شما یافت نشد!\n"
+        "لطفا یک کد معرف معتبر ارسال کنید\n"
+        "(مطمئن شوید کیبورد شما روی زبان انگلیسی است)"
+    )
+    PAYMENT_APPROVED = (
+        "پرداخت شما با موفقیت تأیید شد!\n"
+        "برای کمک شما سپاسگزارم."
+    )
+    PAYMENT_DENIED = (
+        "متأسفانه پرداخت شما تأیید نشد.\n"
+        "لطفا با ادمین (@Ahrarcharity_admin) تماس بگیرید."
+    )
+    _DONATION_FOOTER = (
+        f"💳 شماره کارت:`{CARD_NUMBER}`\n"
+        "📃 آپلود فیش واریزی: /upload"
+    )
+    _REMINDER_FOOTER = (
+        f"💳 شماره کارت: ```{CARD_NUMBER}```\n"
+        "📃 آپلود فیش واریزی: /upload"
+    )
+
     @staticmethod
     def format_donation_reminder(
         full_name: str, amount: str, donation_link: str, month_name: str | None = None
     ) -> str:
         """Format donation reminder message. Optionally include month name."""
-        card_number = "۶۲۲۱۰۶۱۲۳۷۷۵۷۰۸۵"
         header = f"🔰یادآوری پرداخت {month_name}\n\n" if month_name else "🔰یادآوری پرداخت\n\n"
         return (
             f"{header}"
             f"لینک پرداخت: {donation_link}\n\n"
             f"مبلغ تعهد من: {amount}\n"
-            f"💳 شماره کارت:" + f"`{card_number}`" + "\n"
-            f"📃 آپلود فیش واریزی: " + f"/upload"
+            f"{MessageFormatter._DONATION_FOOTER}"
         )
 
     def format_reminder_message(self, month_name: str, donation_link: str, amount: str) -> str:
         """Format a reminder message with the exact requested layout."""
-        card_number = "۶۲۲۱۰۶۱۲۳۷۷۵۷۰۸۵"
         return (
             f"🔰یادآوری پرداخت {month_name} \n"
             f"لینک پرداخت: {donation_link}\n\n"
             f"مبلغ تعهد من: {amount}\n"
-            f"💳 شماره کارت: ```{card_number}```\n"
-            f"📃 آپلود فیش واریزی: " + f"/upload"
+            f"{self._REMINDER_FOOTER}"
         )
 
     @staticmethod
     def format_pin_request() -> str:
         """Format pin request message."""
-        return "سلام\nلطفا کد معرف‌تون رو بفرستید (مثلا 021)"
+        return MessageFormatter.PIN_REQUEST
 
     @staticmethod
     def format_invalid_pin() -> str:
         """Format invalid pin message."""
-        return (
-            "کد شما یافت نشد!\n"
-            "لطفا یک کد معرف معتبر ارسال کنید\n"
-            "(مطمئن شوید کیبورد شما روی زبان انگلیسی است)"
-        )
+        return MessageFormatter.INVALID_PIN
 
     @staticmethod
     def format_verification_request(full_name: str) -> str:
@@ -127,7 +189,7 @@ class MessageFormatter:
 
     @staticmethod
     def format_success_message(
-        donation_link: str, amount: str, card_number: str = "۶۲۲۱۰۶۱۲۳۷۷۵۷۰۸۵"
+        donation_link: str, amount: str, card_number: str = CARD_NUMBER
     ) -> str:
         """Format success message after verification."""
         return (
@@ -137,18 +199,12 @@ class MessageFormatter:
     @staticmethod
     def format_payment_approved() -> str:
         """Format payment approved message."""
-        return (
-            "پرداخت شما با موفقیت تأیید شد!\n"
-            "برای کمک شما سپاسگزارم."
-        )
+        return MessageFormatter.PAYMENT_APPROVED
 
     @staticmethod
     def format_payment_denied() -> str:
         """Format payment denied message."""
-        return (
-            "متأسفانه پرداخت شما تأیید نشد.\n"
-            f"لطفا با ادمین (@Ahrarcharity_admin) تماس بگیرید."
-        )
+        return MessageFormatter.PAYMENT_DENIED
 
 
 def get_next_notification_day(target_day: int) -> tuple[int, int, int]:
@@ -161,8 +217,7 @@ def get_next_notification_day(target_day: int) -> tuple[int, int, int]:
     Returns:
         Tuple of (year, month, day) in Jalali calendar
     """
-    tz = pytz.timezone(TIMEZONE)
-    now = datetime.now(tz)
+    now = datetime.now(_TZ)
     current_year, current_month, current_day = JalaliCalendar.gregorian_to_jalali(
         now
     )
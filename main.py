@@ -1,6 +1,9 @@
 """Main bot application."""
 
+import asyncio
 import logging
+import logging.handlers
+import queue
 from telegram.ext import (
     Application,
     ConversationHandler,
@@ -13,23 +16,32 @@ from telegram.ext import (
 from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.request import HTTPXRequest
-import pytz
+from zoneinfo import ZoneInfo
 from datetime import time
 
-from aharar_bot.config import BOT_TOKEN, TIMEZONE
+from aharar_bot.config import (
+    BOT_TOKEN,
+    TIMEZONE,
+    PUBLIC_HOST,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+)
+from aharar_bot.database import Database
+from aharar_bot.utils import CALLBACK_APPROVE, CALLBACK_DENY, decode_payment_callback
 
 from aharar_bot.handlers import (
     start,
     handle_pin_code,
     handle_verification,
-    show_main_menu,
     handle_card_number,
     handle_donation_link,
     handle_donation_amount,
     handle_payment_upload,
     handle_payment_history,
-    handle_pending_admin_broadcast,
+    main_menu_dispatch,
     handle_protected_command,
+    PROTECTED_COMMANDS,
     cancel,
     logout,
     report_command,
@@ -43,21 +55,41 @@ from aharar_bot.handlers import (
     MAIN_MENU,
 )
 from aharar_bot.scheduler import (
-    send_donation_notification,
-    send_reminder_notification,
+    ApprovalAggregator,
+    run_morning_jobs,
     send_monthly_report,
     handle_payment_approval,
     handle_payment_denial,
 )
 
-# Configure logging
+# Configure logging: records are formatted and enqueued by the QueueHandler,
+# and a listener thread writes them to stderr off the event loop
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO,
+    handlers=[logging.handlers.QueueHandler(_log_queue)],
 )
+log_listener.start()
 logger = logging.getLogger(__name__)
 
 
+# Daily job times in the bot's timezone, resolved once at import
+TZ = ZoneInfo(TIMEZONE)
+MORNING_JOBS_TIME = time(hour=9, minute=0, tzinfo=TZ)
+REPORT_JOB_TIME = time(hour=20, minute=0, tzinfo=TZ)
+
+# The bot only reacts to messages and inline button presses
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Payment button actions (see utils.encode_payment_callback) -> handlers
+_CALLBACK_ROUTES = {
+    CALLBACK_APPROVE: handle_payment_approval,
+    CALLBACK_DENY: handle_payment_denial,
+}
+
+
 async def handle_callback_query(
     update: Update, context: ContextTypes.DEFAULT_TYPE
 ) -> None:
@@ -65,21 +97,31 @@ async def handle_callback_query(
     query = update.callback_query
     await query.answer()
 
-    data = query.data
+    decoded = decode_payment_callback(query.data or "")
+    if decoded is None:
+        return
 
-    if data.startswith("approve_"):
-        payment_id = int(data.split("_")[1])
-        await handle_payment_approval(update, context, payment_id)
-        await query.edit_message_text(text="پرداخت تأیید شد ✅")
+    action, payment_id = decoded
+    handler = _CALLBACK_ROUTES.get(action)
+    if handler is None:
+        return
 
-    elif data.startswith("deny_"):
-        payment_id = int(data.split("_")[1])
-        await handle_payment_denial(update, context, payment_id)
-        await query.edit_message_text(text="پرداخت رد شد ❌")
+    # The decision is queued; the caption is edited once its batch is written
+    await handler(update, context, payment_id)
 
 
 async def post_init(application: Application) -> None:
     """Post initialization tasks."""
+    # Open the shared database connection before any update or job is processed
+    db = Database()
+    await db.init_db()
+    application.bot_data["db"] = db
+
+    # Batches admin approve/deny clicks into single writes and per-user messages
+    approvals = ApprovalAggregator(db, application.bot)
+    approvals.start()
+    application.bot_data["approvals"] = approvals
+
     job_queue: JobQueue = application.job_queue
 
     if job_queue is None:
@@ -88,36 +130,57 @@ async def post_init(application: Application) -> None:
         )
         return
 
-    # Schedule notification on 3rd of each month at 9:00 AM
-    job_queue.run_daily(
-        send_donation_notification,
-        time=time(hour=9, minute=0, tzinfo=pytz.timezone(TIMEZONE)),
-    )
-
-    # Schedule reminder on 7th of each month at 9:00 AM
-    job_queue.run_daily(
-        send_reminder_notification,
-        time=time(hour=9, minute=0, tzinfo=pytz.timezone(TIMEZONE)),
-    )
+    # Donation notification (3rd) and reminder (7th) of each month at 9:00 AM
+    job_queue.run_daily(run_morning_jobs, time=MORNING_JOBS_TIME)
 
     # Schedule report on 10th of each month at 8:00 PM
-    job_queue.run_daily(
-        send_monthly_report,
-        time=time(hour=20, minute=0, tzinfo=pytz.timezone(TIMEZONE)),
-    )
+    job_queue.run_daily(send_monthly_report, time=REPORT_JOB_TIME)
+
+
+async def post_stop(application: Application) -> None:
+    """Flush pending payment decisions while the bot can still send messages."""
+    # Runs after Application.stop() but before shutdown() closes the bot's HTTP client
+    approvals = application.bot_data.get("approvals")
+    if approvals:
+        await approvals.stop()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Close the shared database connection."""
+    db = application.bot_data.get("db")
+    if db:
+        await db.close()
 
 
 def main() -> None:
     """Start the bot."""
+    # Run on uvloop's libuv-based event loop when it is installed (not on Windows)
+    try:
+        import uvloop
+    except ImportError:
+        pass
+    else:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     # Create the Application builder with increased timeouts for unreliable networks
     request = HTTPXRequest(
+        connection_pool_size=256,  # Room for bursts of concurrent sends/edits
+        http_version="2",    # Multiplex Bot API calls over a single HTTP/2 connection
         connect_timeout=20,  # Initial connection timeout
         read_timeout=30,     # Long Polling timeout: 30s allows better tolerance for ISP delays
         write_timeout=20,    # Write timeout for send operations
         pool_timeout=20,     # Connection pool timeout
     )
     
-    builder = Application.builder().token(BOT_TOKEN).request(request).post_init(post_init)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(request)  # Polling shares the same pool and connection
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
     
     application = builder.build()
 
@@ -129,13 +192,11 @@ def main() -> None:
             VERIFICATION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_verification)
             ],
+            # Plain text is the most common input here, so it is checked first;
+            # /cancel is served by the fallbacks and menu commands by global handlers
             MAIN_MENU: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_dispatch),
                 CommandHandler("start", start),
-                CommandHandler("cancel", cancel),
-                # Catch pending broadcast messages in interactive mode
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_pending_admin_broadcast),
-                # Avoid matching slash commands as plain text; only handle non-command text
-                MessageHandler(filters.TEXT & ~filters.COMMAND, show_main_menu),
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
@@ -161,15 +222,30 @@ def main() -> None:
     application.add_handler(CommandHandler("manual_trigger", manual_trigger))
 
     # Register protected user commands globally but enforce verification first
-    application.add_handler(CommandHandler("card", handle_protected_command))
-    application.add_handler(CommandHandler("link", handle_protected_command))
-    application.add_handler(CommandHandler("amount", handle_protected_command))
-    application.add_handler(CommandHandler("upload", handle_protected_command))
-    application.add_handler(CommandHandler("history", handle_protected_command))
-
-    # Start the Bot
-    application.run_polling()
+    application.add_handler(CommandHandler(list(PROTECTED_COMMANDS), handle_protected_command))
+
+    # Start the Bot: webhook when a public host is configured, long polling otherwise
+    if PUBLIC_HOST:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"https://{PUBLIC_HOST}/{BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        application.run_polling(
+            timeout=50,           # Hold each getUpdates open up to 50s while idle
+            poll_interval=0.0,    # Re-poll immediately; Telegram returns up to 100 updates per call
+            bootstrap_retries=-1, # Keep retrying the initial connection on flaky networks
+            allowed_updates=ALLOWED_UPDATES,
+        )
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Flush records still queued after the application has shut down
+        log_listener.stop()
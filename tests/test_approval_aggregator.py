@@ -0,0 +1,97 @@
+"""Tests for the ApprovalAggregator flush on stop."""
+
+import json
+import unittest
+from datetime import datetime
+
+from telegram import Bot, CallbackQuery, Chat, Message, User
+from telegram.request import BaseRequest
+
+from aharar_bot.config import PaymentStatus
+from aharar_bot.scheduler import ApprovalAggregator
+from aharar_bot.utils import MessageFormatter
+
+ADMIN_ID = 1000
+USER_ID = 555
+
+
+class RecordingRequest(BaseRequest):
+    """Bot API transport that records calls and, like HTTPXRequest, fails once shut down."""
+
+    def __init__(self) -> None:
+        self.calls: list[tuple[str, dict]] = []
+        self._initialized = False
+
+    async def initialize(self) -> None:
+        self._initialized = True
+
+    async def shutdown(self) -> None:
+        self._initialized = False
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if not self._initialized:
+            raise RuntimeError("This HTTPXRequest is not initialized!")
+
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((endpoint, params))
+
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}
+        elif endpoint == "sendMessage":
+            result = {"message_id": 2, "date": 0, "chat": {"id": params["chat_id"], "type": "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class FakeDatabase:
+    """Just the two queries a flush makes."""
+
+    def __init__(self) -> None:
+        self.updates: list[dict[int, str]] = []
+
+    async def update_payment_statuses(self, updates: dict[int, str]) -> None:
+        self.updates.append(dict(updates))
+
+    async def get_payment_recipients(self, payment_ids) -> dict[int, int]:
+        return {payment_id: USER_ID for payment_id in payment_ids}
+
+
+class ApprovalAggregatorStopTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.request = RecordingRequest()
+        self.bot = Bot("123:abc", request=self.request, get_updates_request=RecordingRequest())
+        await self.bot.initialize()
+        self.db = FakeDatabase()
+        # A long delay keeps the decision queued until stop() flushes it
+        self.aggregator = ApprovalAggregator(self.db, self.bot, max_delay=60)
+        self.aggregator.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.bot.shutdown()
+
+    def _admin_query(self) -> CallbackQuery:
+        admin = User(ADMIN_ID, "admin", False)
+        message = Message(1, datetime.now(), Chat(ADMIN_ID, Chat.PRIVATE))
+        message.set_bot(self.bot)
+        query = CallbackQuery("q1", admin, "chat", message=message)
+        query.set_bot(self.bot)
+        return query
+
+    async def test_stop_flushes_notification_and_caption(self) -> None:
+        self.aggregator.submit(7, PaymentStatus.APPROVED, self._admin_query())
+
+        await self.aggregator.stop()
+
+        self.assertEqual(self.db.updates, [{7: PaymentStatus.APPROVED}])
+        calls = dict(self.request.calls)
+        self.assertEqual(calls["sendMessage"]["chat_id"], USER_ID)
+        self.assertEqual(calls["sendMessage"]["text"], MessageFormatter.PAYMENT_APPROVED)
+        self.assertEqual(calls["editMessageCaption"]["chat_id"], ADMIN_ID)
+        self.assertEqual(calls["editMessageCaption"]["caption"], "پرداخت تأیید شد ✅")
+
+
+if __name__ == "__main__":
+    unittest.main()
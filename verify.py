@@ -6,10 +6,38 @@ This script verifies that all components of the bot are properly installed
 and configured.
 """
 
+import os
 import sys
 from pathlib import Path
 import importlib.util
 
+REQUIRED_FILES = (
+    "main.py",
+    "aharar_bot/config.py",
+    "aharar_bot/database.py",
+    "aharar_bot/handlers.py",
+    "aharar_bot/scheduler.py",
+    "aharar_bot/models.py",
+    "aharar_bot/utils.py",
+    "requirements.txt",
+    "docker/Dockerfile",
+    "docker-compose.yml",
+    ".env.example",
+    "README.md",
+)
+
+# (import name, package name shown to the user)
+REQUIRED_MODULES = (
+    ("telegram", "python-telegram-bot"),
+    ("h2", "h2 (python-telegram-bot[http2])"),
+    ("pydantic", "pydantic"),
+    ("tzdata", "tzdata"),
+    ("aiosqlite", "aiosqlite"),
+    ("aiolimiter", "aiolimiter"),
+    ("xlsxwriter", "XlsxWriter"),
+    ("reportlab", "reportlab"),
+)
+
 
 def check_python_version() -> bool:
     """Check Python version."""
@@ -23,25 +51,20 @@ def check_python_version() -> bool:
 
 def check_files() -> bool:
     """Check if all required files exist."""
-    required_files = [
-        "main.py",
-        "config.py",
-        "database.py",
-        "handlers.py",
-        "scheduler.py",
-        "models.py",
-        "utils.py",
-        "requirements.txt",
-        "Dockerfile",
-        "docker-compose.yml",
-        ".env.example",
-        "README.md",
-    ]
-
+    # List each directory once instead of stat()-ing every file
+    listings: dict[str, set[str]] = {}
     all_exist = True
-    for file in required_files:
-        path = Path(file)
-        if path.exists():
+    for file in REQUIRED_FILES:
+        directory, name = os.path.split(file)
+        directory = directory or "."
+        if directory not in listings:
+            try:
+                with os.scandir(directory) as entries:
+                    listings[directory] = {entry.name for entry in entries}
+            except FileNotFoundError:
+                listings[directory] = set()
+
+        if name in listings[directory]:
             print(f"✅ {file}")
         else:
             print(f"❌ {file} - MISSING")
@@ -51,21 +74,13 @@ def check_files() -> bool:
 
 
 def check_modules() -> bool:
-    """Check if required Python modules can be imported."""
-    required_modules = {
-        "telegram": "python-telegram-bot",
-        "pydantic": "pydantic",
-        "pytz": "pytz",
-        "openpyxl": "openpyxl",
-        "reportlab": "reportlab",
-    }
-
+    """Check if required Python modules are installed."""
+    # find_spec locates a module without running its (sometimes heavy) import code
     all_available = True
-    for module, package in required_modules.items():
-        try:
-            importlib.import_module(module)
+    for module, package in REQUIRED_MODULES:
+        if importlib.util.find_spec(module) is not None:
             print(f"✅ {package}")
-        except ImportError:
+        else:
             print(f"❌ {package} - NOT INSTALLED")
             all_available = False
 